@@ -4,50 +4,182 @@ Groups questions by type and processes them in parallel batches.
 """
 
 import asyncio
-from typing import List, Dict, Any, Optional
+import atexit
+import contextlib
+import functools
+import json
+import re
+import sys
+import threading
+import time
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 from collections import defaultdict
 import logging
+from pathlib import Path
 
 import os
 
-from llm_engine import run_gemini_async
-from prompt_builder import build_prompt_for_batch, get_files
+import orjson
 
-# ... (imports)
+from llm_engine import DEFAULT_MAX_CONCURRENCY, run_gemini_async
+from parse_utils import load_yaml, loads_json_object, strip_code_fences
+from prompt_builder import build_prompt_for_batch, get_files
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 DEFAULT_BATCH_SIZE = 4
 
+# Per-question keys are "question<N>" (see split_generated_content)
+_QKEY_PREFIX = "question"
+_QKEY_PREFIX_LEN = len(_QKEY_PREFIX)
+
+# Explicit delimiter the generation prompts emit before every question block
+_QUESTION_DELIM = "|||QUESTION_START|||"
+
+# Fallback split: (Newline or Start) + (Optional **) + Question/QUESTION + [N] or N + (Optional ] or : or **)
+# Captures the question number (Group 1)
+_QUESTION_FALLBACK_RE = re.compile(r'(?:\n|^)\s*(?:\*\*)?\s*(?:Question|QUESTION)\s*(?:\[)?\s*(\d+)\s*(?:\])?\s*(?:\*\*|:)?')
+
+# Runs of whitespace inside topic names (collapsed to a single space)
+_WS_RE = re.compile(r'\s+')
+
+# Shared decoder for raw_decode scans (stateless, safe to reuse across batches)
+_JSON_DECODER = json.JSONDecoder()
+
+# Separator between the question type and the batch number in batch keys ("MCQ - Batch 2")
+BATCH_KEY_SEP = ' - Batch '
+
+# Placeholders in the validation prompt template, filled in a single pass per batch
+_VALIDATION_PLACEHOLDER_RE = re.compile(r"\{\{(GENERATED_CONTENT|INPUT_CONTEXT|OUTPUT_FORMAT_RULES)\}\}")
+
+# Validation templates (loaded lazily on first pipeline run, then cached)
+VALIDATION_FILE = Path(__file__).parent / "validation.yaml"
+_VALIDATION_CONFIG_CACHE: Optional[Dict[str, Any]] = None
+
+# Mapping from UI question types to their output structure key in validation.yaml
+_STRUCTURE_MAP = {
+    "MCQ": "structure_MCQ",
+    "Fill in the Blanks": "structure_FIB",
+    "Case Study": "structure_Case_Study",
+    "Multi-Part": "structure_Multi_Part",
+    "Assertion-Reasoning": "structure_AR",
+    "Descriptive": "structure_Descriptive",
+    "Descriptive w/ Subquestions": "structure_Descriptive_w_subq"
+}
+
+
+def _json_dumps(obj: Any) -> str:
+    """
+    Serialize to a compact JSON string (non-ASCII kept as-is).
+    """
+    return orjson.dumps(obj).decode("utf-8")
+
+
+def _parse_validator_json(text: str) -> Optional[Any]:
+    """
+    Parse the validator's JSON output. The raw text is tried first; markdown fences
+    are only stripped (and the text re-parsed) when that fails. Returns None if unparseable.
+    """
+    try:
+        return orjson.loads(text)
+    except ValueError:
+        pass
+    
+    clean = text.strip()
+    if clean.startswith("```"):
+        clean = strip_code_fences(clean)
+    try:
+        return orjson.loads(clean)
+    except ValueError:
+        return None
+
+
+def _load_validation_config() -> Dict[str, Any]:
+    """
+    Load and cache validation.yaml. Parsed once per process; raises if the file is missing or invalid.
+    """
+    global _VALIDATION_CONFIG_CACHE
+    if _VALIDATION_CONFIG_CACHE is None:
+        with open(VALIDATION_FILE, 'r', encoding='utf-8') as f:
+            _VALIDATION_CONFIG_CACHE = load_yaml(f) or {}
+    return _VALIDATION_CONFIG_CACHE
+
+
+class _MetadataLog:
+    """
+    Append-only NDJSON log of extracted core skill metadata.
+    Records are buffered in memory and written with a single append per flush; batch flows
+    flush after each batch, pipeline runs at the end, and the process at exit. Records stay
+    buffered until a write succeeds, up to MAX_BUFFERED_RECORDS; beyond that the oldest are
+    dropped. A new log file is started once the current one reaches MAX_FILE_BYTES.
+    """
+    MAX_FILE_BYTES = 10 * 1024 * 1024
+    MAX_BUFFERED_RECORDS = 10000
+
+    def __init__(self, log_dir: str = "metadata_logs"):
+        self.log_dir = Path(log_dir)
+        self.filepath: Optional[Path] = None
+        self._session = time.strftime('%Y%m%d_%H%M%S')
+        self._part = 0
+        self._file_size = 0
+        # (file, record) pairs; records are assigned to a file when buffered
+        self._buffer: List[Tuple[Path, str]] = []
+        # Thread lock (not asyncio.Lock): flushes also run on worker threads and at exit
+        self._lock = threading.Lock()
+
+    def write(self, batch_key: str, metadata: Dict[str, Any]) -> str:
+        record = _json_dumps({"batch_key": batch_key, "timestamp": time.strftime("%Y%m%d_%H%M%S"), "metadata": metadata}) + "\n"
+        record_bytes = len(record.encode("utf-8"))
+        with self._lock:
+            if self.filepath is None or self._file_size + record_bytes > self.MAX_FILE_BYTES:
+                self._part += 1
+                self.filepath = self.log_dir / f"session_{self._session}_{self._part:03d}.ndjson"
+                self._file_size = 0
+            self._file_size += record_bytes
+            self._buffer.append((self.filepath, record))
+            return str(self.filepath)
+
+    def flush(self) -> None:
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self) -> None:
+        # One append per file, oldest first; a failed write keeps its records for the next flush
+        while self._buffer:
+            filepath = self._buffer[0][0]
+            count = 1
+            while count < len(self._buffer) and self._buffer[count][0] == filepath:
+                count += 1
+            try:
+                self.log_dir.mkdir(exist_ok=True)
+                with open(filepath, "a", encoding="utf-8") as f:
+                    f.write("".join(record for _, record in self._buffer[:count]))
+            except Exception as e:
+                logger.error(f"Failed to save metadata (will retry on next flush): {e}")
+                overflow = len(self._buffer) - self.MAX_BUFFERED_RECORDS
+                if overflow > 0:
+                    del self._buffer[:overflow]
+                    logger.error(f"Metadata buffer full: dropped {overflow} oldest records")
+                return
+            del self._buffer[:count]
+            logger.info(f"Metadata log flushed to {filepath}")
+
+
+_METADATA_LOG = _MetadataLog()
+atexit.register(_METADATA_LOG.flush)
+
 
 def _save_metadata_to_file(metadata: Dict[str, Any], batch_key: str) -> Optional[str]:
     """
-    Save extracted metadata to a file in metadata_logs directory.
+    Append extracted metadata to the session log in metadata_logs directory.
+    The record is buffered; it reaches disk on the next flush.
     """
     if not metadata:
         return None
         
     try:
-        from pathlib import Path
-        import time
-        import json
-        
-        log_dir = Path("metadata_logs")
-        log_dir.mkdir(exist_ok=True)
-        
-        # Clean batch key for filename
-        clean_key = "".join(c if c.isalnum() or c in "._-" else "_" for c in batch_key)
-        timestamp = time.strftime("%Y%m%d_%H%M%S")
-        filename = f"metadata_{clean_key}_{timestamp}.txt"
-        filepath = log_dir / filename
-        
-        with open(filepath, "w", encoding="utf-8") as f:
-            # Save as pretty JSON as shown in user example
-            f.write(json.dumps(metadata, indent=2))
-        
-        logger.info(f"Metadata saved to {filepath}")
-        return str(filepath)
+        return _METADATA_LOG.write(batch_key, metadata)
     except Exception as e:
         logger.error(f"Failed to save metadata: {e}")
         return None
@@ -58,7 +190,11 @@ def extract_first_json_match(text: str) -> Dict[str, Any]:
     Helper to find first valid JSON object using raw_decode.
     Handles trailing text (like '```') automatically.
     """
-    import json
+    # Fast path: the whole response is a single JSON object
+    obj = loads_json_object(text)
+    if obj is not None:
+        return obj
+    
     try:
         # Find closest opening brace
         start_idx = text.find('{')
@@ -66,14 +202,20 @@ def extract_first_json_match(text: str) -> Dict[str, Any]:
             return None 
         
         # Use raw_decode which returns (obj, end_index) and ignores trailing text
-        decoder = json.JSONDecoder()
-        obj, _ = decoder.raw_decode(text, idx=start_idx)
+        obj, _ = _JSON_DECODER.raw_decode(text, idx=start_idx)
         return obj
     except Exception:
         return None
 
 
 
+def _count_metadata_entries(metadata: Dict[str, Any]) -> int:
+    """
+    Count the non-empty comma-separated entries across all metadata values (for logging).
+    """
+    return sum(1 for v in metadata.values() for item in str(v).split(',') if item.strip())
+
+
 def extract_core_skill_metadata(response_text: str) -> Dict[str, Any]:
     """
     Extract the core skill JSON metadata from LLM response.
@@ -96,13 +238,9 @@ def extract_core_skill_metadata(response_text: str) -> Dict[str, Any]:
                  else:
                      clean_metadata[k] = str(v)
              
-             # Calculate total entries across all metadata keys
-             total_entries = 0
-             for v in clean_metadata.values():
-                 if v and isinstance(v, str):
-                     total_entries += len([item for item in v.split(',') if item.strip()])
-             
-             logger.info(f"Extracted cumulative metadata with approx {total_entries} total entries")
+             # Calculate total entries across all metadata keys (only when it will be logged)
+             if logger.isEnabledFor(logging.INFO):
+                 logger.info(f"Extracted cumulative metadata with approx {_count_metadata_entries(clean_metadata)} total entries")
              return clean_metadata
 
     logger.warning("Could not extract core skill metadata from response")
@@ -110,105 +248,127 @@ def extract_core_skill_metadata(response_text: str) -> Dict[str, Any]:
 
 
 
-def group_questions_by_type_and_topic(questions_config: List[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+def _chunks(seq: List[Any], size: int) -> Iterator[List[Any]]:
+    """
+    Yield consecutive slices of seq with at most size items (batches are cut by position).
+    """
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+
+def batch_key_of(base_type: str, batch_num: int) -> str:
+    """
+    Build the key for a batch of a question type: ("MCQ", 2) -> "MCQ - Batch 2".
+    """
+    return f"{base_type}{BATCH_KEY_SEP}{batch_num}"
+
+
+def split_batch_key(batch_key: str) -> Tuple[str, int]:
+    """
+    Split a batch key into (base type, batch number): "MCQ - Batch 2" -> ("MCQ", 2).
+    Keys without a batch suffix map to batch 1. Only the first suffix counts,
+    so "MCQ - Batch 2 - Batch 1" -> ("MCQ", 2).
+    """
+    base_type, _, tail = batch_key.partition(BATCH_KEY_SEP)
+    num = tail.partition(' ')[0]
+    return base_type, int(num) if num.isdecimal() else 1
+
+
+@functools.lru_cache(maxsize=4096)
+def _normalize_topic_text(topic: str) -> str:
+    # Topics recur across batches and runs; interned keys also make the grouping dict lookups cheaper
+    return sys.intern(_WS_RE.sub(' ', topic.strip().lower()))
+
+
+def _normalize_topic(raw_topic: Any) -> str:
+    """
+    Normalize a topic for grouping: lowercase, strip, collapse internal spaces. None or '' -> 'unknown'.
+    """
+    return _normalize_topic_text(str(raw_topic or 'Unknown'))
+
+
+def group_questions_by_type_and_topic(
+    questions_config: List[Dict[str, Any]],
+    batch_size: int = DEFAULT_BATCH_SIZE
+) -> Dict[str, List[Dict[str, Any]]]:
     """
     Group questions by question type for batch processing using Priority Packing.
     
     Strategy:
     1. Group by Type.
     2. Within each Type, grouping by Topic.
-    3. For each Topic, extract FULL BATCHES (size 4) immediately.
+    3. For each Topic, extract FULL BATCHES (size batch_size, default 4) immediately.
     4. Collect all remaining questions (remainders) into a pool.
-    5. Pack the remainder pool into mixed batches of size 4.
+    5. Pack the remainder pool into mixed batches of size batch_size.
     
     This ensures maximal topic coherence in batches to avoid duplication issues 
     while maintaining efficient batch sizes.
     """
     grouped_by_type = defaultdict(list)
-    BATCH_SIZE = DEFAULT_BATCH_SIZE
+    # Normalized topic keys per type, parallel to grouped_by_type (position i <-> question i),
+    # so the passes below work on plain lists instead of re-reading the question dicts
+    topics_by_type = defaultdict(list)
+    BATCH_SIZE = batch_size
 
     # 1. Initial Grouping by Type
     for idx, q_config in enumerate(questions_config):
         q_type = q_config.get('type', 'MCQ')
         q_config['original_index'] = idx
         grouped_by_type[q_type].append(q_config)
+        topics_by_type[q_type].append(_normalize_topic(q_config.get('topic')))
     
     final_grouped = {}
 
     for q_type, type_questions in grouped_by_type.items():
+        type_topics = topics_by_type[q_type]
         # Smart Preservation Logic
         # Goal: Preserve original order unless we detect INEFFICIENT topic splitting.
         
-        # 1. Analyze Input Batches (Hypothetical)
+        # 1. Analyze Input Batches (Hypothetical) in a single pass
+        # Batches are visited in order, so a per-topic running tally is enough:
+        # topic_stats[topic] = [last_batch, batches_spanned, count_in_last_batch, max_in_one_batch, total]
         needs_optimization = False
-        topic_batch_map = defaultdict(list)
+        topic_stats: Dict[str, List[int]] = {}
         
         # Simulate batch assignment based on current order
-        for i, q in enumerate(type_questions):
-            current_batch_idx = i // BATCH_SIZE
-            raw_topic = q.get('topic', '') or 'Unknown'
-            # Enhanced normalization: lower, strip, and collapse internal spaces
-            topic_key = " ".join(str(raw_topic).strip().lower().split())
-            topic_batch_map[topic_key].append(current_batch_idx)
+        for i, topic_key in enumerate(type_topics):
+            batch_idx = i // BATCH_SIZE
+            stats = topic_stats.get(topic_key)
+            if stats is None:
+                topic_stats[topic_key] = [batch_idx, 1, 1, 1, 1]
+                continue
+            if stats[0] == batch_idx:
+                stats[2] += 1
+            else:
+                stats[0] = batch_idx
+                stats[1] += 1
+                stats[2] = 1
+            if stats[2] > stats[3]:
+                stats[3] = stats[2]
+            stats[4] += 1
 
         # 2. Check for inefficiency
-        for topic, batch_indices in topic_batch_map.items():
+        # Definition: INEFFICIENT if we have multiple partial chunks of the same topic
+        # that COULD be combined into a fuller chunk ("Priority Packing" puts 4s together).
+        # - total >= 4 but no batch holds a full chunk of 4 (e.g. 2 in B1, 2 in B2; 3 + 3 instead of 4 + 2)
+        # - total < 4 but split across batches (e.g. 1 in B1, 1 in B2)
+        # Both reduce to: the topic spans several batches and none of them holds a full chunk.
+        for topic, (_, batches_spanned, _, max_count, total_count) in topic_stats.items():
             # If topic appears in only one batch -> Efficient.
-            unique_batches = sorted(list(set(batch_indices)))
-            if len(unique_batches) <= 1:
+            if batches_spanned <= 1 or max_count >= BATCH_SIZE:
                 continue
             
-            # If topic spans multiple batches, check usage.
-            # It is EFFICIENT if all earlier batches are saturated with this topic?
-            # Or simpler: It is INEFFICIENT if a topic is split across batches 
-            # where the earlier batch had < BATCH_SIZE questions of that topic?
-            # NO, earlier batch might be full of OTHER topics.
-            
-            # Definition: INEFFICIENT if we have multiple partial chunks of the same topic 
-            # that COULD be combined into a fuller chunk.
-            # Example Bad: Batch 1 has 2 'A', Batch 2 has 2 'A'. (Total 4 'A').
-            # We could have put 4 'A' in one batch.
-            
-            # We check if the topic count in any batch is partial (< 4) AND there are more of that topic elsewhere.
-            # Actually, "Priority Packing" puts 4s together.
-            # So if we see a topic with total count >= 4, but it never forms a chunk of 4 in input -> INEFFICIENT.
-            # Or if total count < 4, but it is split (e.g. 1 in B1, 1 in B2) -> INEFFICIENT.
-            
-            total_count = len(batch_indices)
-            
-            # Check consistency
-            # Count occurrences per batch
-            counts_per_batch = defaultdict(int)
-            for b_idx in batch_indices:
-                counts_per_batch[b_idx] += 1
-                
-            # If any batch has a partial amount (< BATCH_SIZE) AND we have other batches with this topic,
-            # could we have done better?
-            # Yes, we could have combined them.
-            # Exception: If the split is necessary because we have too many (e.g. 6 items -> 4 + 2).
-            # In that case, one batch MUST have 4.
-            # So if we have NO batch with 4 items for this topic, but we have multiple batches -> Could be potentially optimized?
-            # Wait, if total=6, and we have 3 in B1, 3 in B2 -> Inefficient (should be 4, 2).
-            
-            # Rule: Reorder if we find a topic that is split across batches AND doesn't have a max-capacity chunk (4) where possible.
-            has_full_chunk = any(c == BATCH_SIZE for c in counts_per_batch.values())
-            
-            if total_count >= BATCH_SIZE and not has_full_chunk:
-                needs_optimization = True
-                logger.info(f"[{q_type}] Optimization needed: Topic '{topic}' (Count {total_count}) fragmented inefficiently across batches {dict(counts_per_batch)}")
-                break
-                
-            # Also handle small fragmentation: 2 in B1, 2 in B2 (Total 4).
-            # total_count=4. has_full_chunk=False. -> True. Correct.
-            
-            # What about Total=2? 1 in B1, 1 in B2.
-            # total_count=2. < BATCH_SIZE.
-            # Is 1+1 inefficient? Yes, we want 2 together.
-            # So if total < BATCH_SIZE and len(unique_batches) > 1 -> Inefficient.
-            if total_count < BATCH_SIZE and len(unique_batches) > 1:
-                needs_optimization = True
-                logger.info(f"[{q_type}] Optimization needed: Topic '{topic}' (Count {total_count}) fragmented across batches {unique_batches}")
-                break
+            needs_optimization = True
+            if logger.isEnabledFor(logging.INFO):
+                spanned = defaultdict(int)
+                for i, topic_key in enumerate(type_topics):
+                    if topic_key == topic:
+                        spanned[i // BATCH_SIZE] += 1
+                if total_count >= BATCH_SIZE:
+                    logger.info(f"[{q_type}] Optimization needed: Topic '{topic}' (Count {total_count}) fragmented inefficiently across batches {dict(spanned)}")
+                else:
+                    logger.info(f"[{q_type}] Optimization needed: Topic '{topic}' (Count {total_count}) fragmented across batches {list(spanned)}")
+            break
 
         if not needs_optimization:
             logger.info(f"  - {q_type}: {len(type_questions)} questions (Preserved User Order - Efficient)")
@@ -218,44 +378,30 @@ def group_questions_by_type_and_topic(questions_config: List[Dict[str, Any]]) ->
         logger.info(f"  - {q_type}: Reordering for efficiency (Priority Packing applied)")
         
         # 3. Priority Packing (Original Logic)
-        topic_map = defaultdict(list)
-        topic_order = [] # Preserve original order of topics
-        for q in type_questions:
-            # Normalize topic: lowercase, strip, collapse spaces. Handle None.
-            raw_topic = q.get('topic', '') or 'Unknown'
-            topic_key = " ".join(str(raw_topic).strip().lower().split())
-            if topic_key not in topic_map:
-                topic_order.append(topic_key)
-            topic_map[topic_key].append(q)
+        # Works on positions within type_questions; dict insertion order keeps topic appearance order
+        topic_positions = defaultdict(list)
+        for i, topic_key in enumerate(type_topics):
+            topic_positions[topic_key].append(i)
             
-        final_list_for_type = []
+        packed_positions = []
         remainder_pool = []
         
         # 3. Extract Full Batches
         # Preserve original topic appearance order
-        for topic in topic_order:
-            questions = topic_map[topic]
-            
-            # While we have enough for a full batch
-            while len(questions) >= BATCH_SIZE:
-                # Take chunk
-                chunk = questions[:BATCH_SIZE]
-                questions = questions[BATCH_SIZE:] # Remove processed
-                
-                # Add to final list
-                final_list_for_type.extend(chunk)
-            
-            # Add remaining to pool
-            remainder_pool.extend(questions)
+        for positions in topic_positions.values():
+            # Take every full batch at once; the tail (< BATCH_SIZE) goes to the pool
+            full_end = (len(positions) // BATCH_SIZE) * BATCH_SIZE
+            packed_positions.extend(positions[:full_end])
+            remainder_pool.extend(positions[full_end:])
             
         # 4. Pack Remainder Pool
         # We sort the pool by original index to ensure that while topics are grouped when possible,
         # we don't unnecessarily reorder small topics or "leftovers" from one batch to much earlier ones.
-        remainder_pool.sort(key=lambda x: x.get('original_index', 0))
-        
-        chunks = [remainder_pool[i:i + BATCH_SIZE] for i in range(0, len(remainder_pool), BATCH_SIZE)]
-        for chunk in chunks:
-            final_list_for_type.extend(chunk)
+        # (positions follow original index order within a type, so plain int sorting is enough)
+        # Batch boundaries are positional (sliced by BATCH_SIZE downstream), so the pool is appended as-is.
+        remainder_pool.sort()
+        packed_positions.extend(remainder_pool)
+        final_list_for_type = [type_questions[i] for i in packed_positions]
             
         final_grouped[q_type] = final_list_for_type
         
@@ -282,7 +428,7 @@ async def generate_raw_batch(
     try:
         # Build the prompt for this batch
         # Extract base type key (remove " - Batch X" suffix) for template lookup
-        base_key = batch_key.split(' - Batch ')[0]
+        base_key = split_batch_key(batch_key)[0]
         prompt_data = build_prompt_for_batch(base_key, questions, general_config, type_config, previous_batch_metadata)
         
         prompt_text = prompt_data['prompt']
@@ -369,92 +515,53 @@ async def validate_batch(
         }
 
 
-async def process_batches_pipeline(
-    questions_config: List[Dict[str, Any]],
-    general_config: Dict[str, Any],
-    progress_callback=None
-) -> Dict[str, Dict[str, Any]]:
+def _validation_context_line(q_num: int, q_config: Dict[str, Any]) -> str:
     """
-    Process questions in a BATCHED SEQUENTIAL pipeline:
-    1. Split questions into batches of 5 for each type.
-    2. Process batches of the SAME type SEQUENTIALLY (Batch 1 -> Batch 2).
-    3. Process different question types in PARALLEL.
-    
-    Architecture:
-    ┌─ MCQ Task ───────────────────────────────────┐
-    │  [Batch 1 Gen -> Val] → [Batch 2 Gen -> Val] │
-    └──────────────────────────────────────────────┘
-    ┌─ FIB Task ───────────────────────────────────┐
-    │  [Batch 1 Gen -> Val] → [Batch 2 Gen -> Val] │
-    └──────────────────────────────────────────────┘
-    
-    Returns:
-        Flattened dictionary of results, e.g.:
-        {
-            "MCQ - Batch 1": {...},
-            "MCQ - Batch 2": {...},
-            "FIB - Batch 1": {...}
-        }
+    Describe one question's configuration for the validator's INPUT_CONTEXT.
     """
-    logger.info(f"Starting batched pipeline processing for {len(questions_config)} questions")
-    
-    # Group questions by type
-    grouped_questions = group_questions_by_type_and_topic(questions_config)
-    
-    # Load validation prompt template
-    try:
-        import yaml
-        with open('validation.yaml', 'r', encoding='utf-8') as f:
-            validation_config = yaml.safe_load(f)
-            validation_prompt_template = validation_config.get('validation_prompt', '')
-            if not validation_prompt_template:
-                logger.warning("Validation prompt not found under key 'validation_prompt'. Falling back to raw file read.")
-                with open('validation.yaml', 'r', encoding='utf-8') as f:
-                    validation_prompt_template = f.read()
+    spec = q_config.get('mcq_type') or q_config.get('fib_type') or q_config.get('descriptive_type') or "Standard"
+    q_notes = q_config.get('additional_notes_text', '')
+    notes = f", Notes='{q_notes}'" if q_notes else ""
+    return (
+        f"Question {q_num}: Topic='{q_config.get('topic', 'Unknown')}', Type='{spec}', "
+        f"DOK='{q_config.get('dok', 'N/A')}', Marks='{q_config.get('marks', 'N/A')}', "
+        f"Taxonomy='{q_config.get('taxonomy', 'N/A')}'{notes}"
+    )
+
+
+def _delimited_blocks(text: str, start: int) -> Iterator[str]:
+    """
+    Yield the blocks of text between question delimiters, from start to the end.
+    Each block is sliced straight out of text as it is reached (no intermediate list).
+    """
+    delim_len = len(_QUESTION_DELIM)
+    while True:
+        end = text.find(_QUESTION_DELIM, start)
+        if end == -1:
+            yield text[start:]
+            return
+        yield text[start:end]
+        start = end + delim_len
 
-    except Exception as e:
-        logger.error(f"Failed to load validation.yaml: {e}")
-        return {'error': "Critical: validation.yaml not found"}
 
-    pipeline_results = {}
-    
 def split_generated_content(text: str) -> Dict[str, str]:
     """
     Split the raw generated markdown into individual question blocks using the explicit delimiter.
     Delimiter: |||QUESTION_START|||
     """
-    questions = {}
+    # Everything before the first delimiter is preamble/plan and is never copied
+    first = text.find(_QUESTION_DELIM)
     
-    # Check if delimiter exists
-    if "|||QUESTION_START|||" not in text:
+    if first == -1:
         logger.warning("Explicit delimiter '|||QUESTION_START|||' not found. Attempting fallback split by regex patterns.")
         
-        # Fallback: Multi-pattern split
-        # Matches:
-        # 1. **Question [1]** or **Question 1**
-        # 2. QUESTION 1 or Question 1:
-        # 3. **Question 1:**
-        import re
-        # Pattern captures the index (Group 1)
-        # We look for "Question" followed by optional space/bracket, digits, optional closing bracket/colon/bold chars
-        # Examples: "**Question 1**", "Question [1]", "QUESTION 1"
-        pattern = r'(?:\*\*|#|\n|^)?\s*(?:Question|QUESTION)\s*(?:\[)?(\d+)(?:\])?\s*(?:\*\*|:)?'
-        
-        # We use re.split capturing group 1 (the number)
-        # Note: This might be too aggressive if "Question 1" appears in the text.
-        # We try to anchor it or rely on markdown header syntax like ** or # if possible, but user said "QUESTION 1" is possible.
-        # Let's try a robust pattern that requires newline before or is a clear header.
-        
-        # Revised Pattern:
-        # (Newline or Start) + (Optional **) + Question/QUESTION + (Optional space) + [N] or N + (Optional ] or : or **)
-        pattern = r'(?:\n|^)\s*(?:\*\*)?\s*(?:Question|QUESTION)\s*(?:\[)?\s*(\d+)\s*(?:\])?\s*(?:\*\*|:)?'
-        
-        parts = re.split(pattern, text)
+        # Fallback: Multi-pattern split on "Question N" style headers
+        # Examples: "**Question 1**", "Question [1]", "QUESTION 1", "**Question 1:**"
+        # parts[0] is preamble. parts[1]=num, parts[2]=content, parts[3]=num...
+        parts = _QUESTION_FALLBACK_RE.split(text)
         
         if len(parts) >= 2:
              questions = {}
-             # parts[0] is preamble.
-             # Loop: parts[1]=num, parts[2]=content, parts[3]=num...
              for i in range(1, len(parts), 2):
                 q_num = parts[i]
                 content = parts[i+1]
@@ -469,34 +576,9 @@ def split_generated_content(text: str) -> Dict[str, str]:
         logger.warning("Fallback split also failed. returning full text.")
         return {"question1": text}
     
-    # Split by delimiter
-    # The first part might be preamble/plan
-    parts = text.split("|||QUESTION_START|||")
-    
-    # Skip preamble (part 0)
-    # But check if part 0 contains a question? Usually preamble is first.
-    # If the output starts immediately with delimiter, part 0 is empty.
-    
-    q_index = 1
-    start_index = 1
-    
-    # If the text starts with the delimiter, part 0 is empty string.
-    if text.strip().startswith("|||QUESTION_START|||"):
-        start_index = 1 # part 0 is empty
-    elif len(parts) > 1:
-        # Preamble exists
-        start_index = 1
-    else:
-        # Should not happen based on 'if' check above
-        start_index = 0
-
-    for i in range(start_index, len(parts)):
-        content = parts[i].strip()
-        if not content: continue
-        
-        key = f"question{q_index}"
-        questions[key] = content
-        q_index += 1
+    # Skip empty blocks, numbering the remaining ones sequentially
+    blocks = (block.strip() for block in _delimited_blocks(text, first + len(_QUESTION_DELIM)))
+    questions = {f"question{i}": content for i, content in enumerate(filter(None, blocks), 1)}
         
     logger.info(f"Split generated content into {len(questions)} items: {list(questions.keys())}")
     return questions
@@ -510,31 +592,41 @@ async def process_single_batch_flow(
     validation_prompt_template: str = "",
     validation_config: Dict[str, Any] = None,
     progress_callback=None,
-    previous_batch_metadata: Dict[str, Any] = None
+    previous_batch_metadata: Dict[str, Any] = None,
+    semaphore: Optional[asyncio.Semaphore] = None
 ) -> Dict[str, Any]:
     """
     Process a SINGLE batch through the full Generation -> Split -> Parallel Validation flow.
     
+    If a semaphore is given, each Gemini call (generation and validation) holds it
+    while in flight so parallel flows stay within the API concurrency limit.
+    
     Returns:
         Dict containing batch results and optionally 'core_skill_metadata' if extraction is enabled.
     """
     logger.info(f"[{batch_key}] Starting Parallel Flow")
     
+    limiter = semaphore or contextlib.nullcontext()
+    
     # --- STAGE 1: GENERATION ---
-    raw_result = await generate_raw_batch(batch_key, questions, general_config, type_config, previous_batch_metadata)
+    async with limiter:
+        raw_result = await generate_raw_batch(batch_key, questions, general_config, type_config, previous_batch_metadata)
     
     # Extract core skill metadata if enabled
     core_skill_metadata = {}
+    flush_task = None
     if general_config.get('core_skill_enabled', False) and not raw_result.get('error'):
         core_skill_metadata = extract_core_skill_metadata(raw_result.get('text', ''))
         
         # Save metadata to file if extracted
         if core_skill_metadata:
             _save_metadata_to_file(core_skill_metadata, batch_key)
+            # Write the record on a worker thread while validation is in flight
+            flush_task = asyncio.create_task(asyncio.to_thread(_METADATA_LOG.flush))
             
         # Count entries for logging
-        entry_count = sum(len([item for item in str(v).split(',') if item.strip()]) for v in core_skill_metadata.values())
-        logger.info(f"[{batch_key}] Extracted core skill metadata: {entry_count} entries")
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(f"[{batch_key}] Extracted core skill metadata: {_count_metadata_entries(core_skill_metadata)} entries")
     
     if raw_result.get('error'):
         logger.warning(f"[{batch_key}] Generation failed. Skipping validation.")
@@ -554,17 +646,8 @@ async def process_single_batch_flow(
     val_file_metadata = {'source_type': 'None (Validation)', 'filenames': []}
     
     # Base Type Key for Structure Map lookup
-    base_type_key = batch_key.split(' - Batch ')[0]
-    structure_map = {
-        "MCQ": "structure_MCQ",
-        "Fill in the Blanks": "structure_FIB",
-        "Case Study": "structure_Case_Study",
-        "Multi-Part": "structure_Multi_Part",
-        "Assertion-Reasoning": "structure_AR",
-        "Descriptive": "structure_Descriptive",
-        "Descriptive w/ Subquestions": "structure_Descriptive_w_subq"
-    }
-    structure_key = structure_map.get(base_type_key)
+    base_type_key = split_batch_key(batch_key)[0]
+    structure_key = _STRUCTURE_MAP.get(base_type_key)
     
     # Load the actual structure format from validation_config
     structure_format = "Return a valid JSON object."  # Default fallback
@@ -575,35 +658,24 @@ async def process_single_batch_flow(
         logger.warning(f"[{batch_key}] No validation config or structure key found, using default")
     
     # Build context for the batch (all questions)
-    context_lines = []
-    for idx, q_config in enumerate(questions):
-        topic_str = q_config.get('topic', 'Unknown')
-        q_notes = q_config.get('additional_notes_text', '')
-        spec = q_config.get('mcq_type') or q_config.get('fib_type') or q_config.get('descriptive_type') or "Standard"
-        
-        dok = q_config.get('dok', 'N/A')
-        marks = q_config.get('marks', 'N/A')
-        taxonomy = q_config.get('taxonomy', 'N/A')
-        
-        context_line = f"Question {idx+1}: Topic='{topic_str}', Type='{spec}', DOK='{dok}', Marks='{marks}', Taxonomy='{taxonomy}'"
-        if q_notes:
-            context_line += f", Notes='{q_notes}'"
-        context_lines.append(context_line)
-    
-    batch_context = "\n".join(context_lines)
+    batch_context = "\n".join(_validation_context_line(idx, q_config) for idx, q_config in enumerate(questions, 1))
     
-    # Construct validation prompt for entire batch
-    val_prompt = validation_prompt_template.replace("{{GENERATED_CONTENT}}", raw_result['text'])
-    val_prompt = val_prompt.replace("{{INPUT_CONTEXT}}", batch_context)
-    val_prompt = val_prompt.replace("{{OUTPUT_FORMAT_RULES}}", structure_format)
+    # Construct validation prompt for entire batch (one scan of the template for all placeholders;
+    # text inserted for one placeholder is never re-scanned for the others)
+    placeholder_values = {
+        'GENERATED_CONTENT': raw_result['text'],
+        'INPUT_CONTEXT': batch_context,
+        'OUTPUT_FORMAT_RULES': structure_format
+    }
+    val_prompt = _VALIDATION_PLACEHOLDER_RE.sub(lambda m: placeholder_values[m.group(1)], validation_prompt_template)
     
     # Call validation API once for the entire batch
-    validation_result = await validate_batch(batch_key, val_prompt, general_config, val_files, val_file_metadata)
+    async with limiter:
+        validation_result = await validate_batch(batch_key, val_prompt, general_config, val_files, val_file_metadata)
     
     logger.info(f"[{batch_key}] Batch validation complete")
     
     # --- FALLBACK: Detect dropped questions and restore from raw generation ---
-    import json as _json
     val_text = validation_result.get('text', '{}')
     
     # Split the raw generation into individual question blocks
@@ -611,26 +683,18 @@ async def process_single_batch_flow(
     expected_count = len(raw_split)
     
     # Count how many questions the validator actually returned
-    try:
-        # Strip markdown fences if present
-        clean_val = val_text.strip()
-        if clean_val.startswith("```"):
-            import re as _re
-            clean_val = _re.sub(r"^```(?:json)?\s*\n?", "", clean_val, flags=_re.IGNORECASE)
-            clean_val = _re.sub(r"\n?\s*```$", "", clean_val)
-        val_obj = _json.loads(clean_val)
-        validated_count = sum(1 for k in val_obj if isinstance(k, str) and k.lower().startswith('question'))
-    except Exception:
+    val_obj = _parse_validator_json(val_text)
+    if isinstance(val_obj, dict):
+        # Case-insensitive prefix check on a slice (avoids lowercasing the whole key)
+        validated_count = sum(1 for k in val_obj if isinstance(k, str) and k[:_QKEY_PREFIX_LEN].lower() == _QKEY_PREFIX)
+    else:
         validated_count = 0
     
     if validated_count < expected_count:
         logger.warning(f"[{batch_key}] Validator returned {validated_count}/{expected_count} questions. Restoring missing questions from raw generation.")
         
-        # Parse the existing validated output (or start fresh)
-        try:
-            merged = _json.loads(clean_val) if validated_count > 0 else {}
-        except Exception:
-            merged = {}
+        # Reuse the already-parsed validated output (or start fresh)
+        merged = val_obj if validated_count > 0 else {}
         
         # Fill in any missing questionN keys from raw split
         for q_key, q_content in raw_split.items():
@@ -638,7 +702,7 @@ async def process_single_batch_flow(
                 merged[q_key] = q_content
                 logger.info(f"[{batch_key}] Restored {q_key} from raw generation.")
         
-        val_text = _json.dumps(merged, ensure_ascii=False)
+        val_text = _json_dumps(merged)
     
     # The validation result should already contain properly formatted JSON
     final_validation_payload = {
@@ -657,127 +721,216 @@ async def process_single_batch_flow(
         'core_skill_metadata': core_skill_metadata
     }
     
+    if flush_task is not None:
+        await flush_task
+    
     if progress_callback: progress_callback(batch_key, result_payload)
     return {batch_key: result_payload, '_metadata': core_skill_metadata}
 
 
+def _failed_batch_result(batch_key: str, questions: List[Dict[str, Any]], error: BaseException) -> Dict[str, Any]:
+    """
+    Build the flow result for a batch whose flow raised, so it still shows up (as an error) in the results.
+    """
+    logger.error(f"Batch flow failed for {batch_key}: {error}")
+    result_payload = {
+        'raw': {
+            'error': str(error),
+            'text': f"Error processing {batch_key} questions: {str(error)}",
+            'elapsed': 0,
+            'question_count': len(questions),
+            'batch_key': batch_key
+        },
+        'validated': {'error': str(error), 'text': ''},
+        'core_skill_metadata': {}
+    }
+    return {batch_key: result_payload, '_metadata': {}}
+
+
+def _merge_metadata(accumulated: Dict[str, List[str]], new_metadata: Dict[str, Any]) -> bool:
+    """
+    Append a batch's comma-separated metadata entries to the per-key lists in accumulated.
+    Blank values are skipped. Returns True if anything was merged.
+    """
+    merged = False
+    for key, new_val in new_metadata.items():
+        if not new_val or not str(new_val).strip():
+            continue
+        accumulated.setdefault(key, []).extend(
+            item.strip() for item in str(new_val).split(',') if item.strip()
+        )
+        merged = True
+    return merged
+
+
 async def process_batches_pipeline(
     questions_config: List[Dict[str, Any]],
     general_config: Dict[str, Any],
-    progress_callback=None
+    progress_callback=None,
+    *,
+    batch_size: int = DEFAULT_BATCH_SIZE
 ) -> Dict[str, Dict[str, Any]]:
     """
     Process ALL batches. Uses PARALLEL flows by default, or SEQUENTIAL per-type
-    when core_skill_enabled is True (to pass metadata between batches).
+    when core_skill_enabled is True (to pass metadata between batches; different
+    types still run concurrently). Questions are cut into batches of batch_size.
     """
     core_skill_enabled = general_config.get('core_skill_enabled', False)
     mode = "SEQUENTIAL (Core Skill)" if core_skill_enabled else "PARALLEL"
-    logger.info(f"Starting {mode} pipeline for {len(questions_config)} questions")
+    logger.info("Starting %s pipeline for %d questions", mode, len(questions_config))
     
     # Group questions by type
-    grouped_questions = group_questions_by_type_and_topic(questions_config)
+    grouped_questions = group_questions_by_type_and_topic(questions_config, batch_size)
     
     # Load validation template
     try:
-        import yaml
-        with open('validation.yaml', 'r', encoding='utf-8') as f:
-            validation_config = yaml.safe_load(f)
-            validation_prompt_template = validation_config.get('validation_prompt', '')
+        validation_config = _load_validation_config()
+        validation_prompt_template = validation_config.get('validation_prompt', '')
     except Exception as e:
-        logger.error(f"Failed to load validation.yaml: {e}")
+        logger.error("Failed to load validation.yaml: %s", e)
         return {'error': "Critical: validation.yaml not found"}
 
     pipeline_results = {}
     
+    # Bound concurrent Gemini calls to avoid 429s when many batches run at once
+    max_concurrency = max(1, int(general_config.get('max_concurrency') or DEFAULT_MAX_CONCURRENCY))
+    semaphore = asyncio.Semaphore(max_concurrency)
+    
     if core_skill_enabled:
-        # SEQUENTIAL PROCESSING: Process each type's batches sequentially to pass metadata
-        logger.info("🔧 Core Skill enabled: Processing batches SEQUENTIALLY per type")
+        # SEQUENTIAL PROCESSING: Process each type's batches sequentially to pass metadata.
+        # Types don't share metadata, so the per-type sequences run concurrently.
+        logger.info("🔧 Core Skill enabled: Processing batches SEQUENTIALLY per type (types in parallel)")
         
-        for base_type_key, all_type_questions in grouped_questions.items():
-            BATCH_SIZE = DEFAULT_BATCH_SIZE
-            batches = [all_type_questions[i:i + BATCH_SIZE] for i in range(0, len(all_type_questions), BATCH_SIZE)]
+        async def run_type_sequential(base_type_key: str, all_type_questions: List[Dict[str, Any]]) -> Dict[str, Any]:
+            type_results = {}
             
-            # Accumulated metadata for this type
-            accumulated_metadata = {}
+            # Accumulated metadata for this type: key -> list of individual entries
+            # (prompt_builder joins list values with ", " when injecting them)
+            accumulated_metadata: Dict[str, List[str]] = {}
             
-            for i, batch_questions in enumerate(batches):
-                batch_key = f"{base_type_key} - Batch {i + 1}"
+            for i, batch_questions in enumerate(_chunks(all_type_questions, batch_size)):
+                batch_key = batch_key_of(base_type_key, i + 1)
                 
-                # Count prior entries for logging
-                prior_count = sum(len([item for item in str(v).split(',') if item.strip()]) for v in accumulated_metadata.values())
-                logger.info(f"[Core Skill] Processing {batch_key} with {prior_count} prior metadata entries")
+                prior_count = sum(map(len, accumulated_metadata.values()))
+                logger.info("[Core Skill] Processing %s with %d prior metadata entries", batch_key, prior_count)
                 
                 # Process this batch with previous metadata
-                result = await process_single_batch_flow(
-                    batch_key=batch_key,
-                    questions=batch_questions,
-                    general_config=general_config,
-                    type_config=None,
-                    validation_prompt_template=validation_prompt_template,
-                    validation_config=validation_config,
-                    progress_callback=progress_callback,
-                    previous_batch_metadata=accumulated_metadata if accumulated_metadata else None
-                )
+                # A failing batch is reported in its slot and the type's sequence continues
+                try:
+                    result = await process_single_batch_flow(
+                        batch_key=batch_key,
+                        questions=batch_questions,
+                        general_config=general_config,
+                        type_config=None,
+                        validation_prompt_template=validation_prompt_template,
+                        validation_config=validation_config,
+                        progress_callback=progress_callback,
+                        previous_batch_metadata=accumulated_metadata if accumulated_metadata else None,
+                        semaphore=semaphore
+                    )
+                except Exception as e:
+                    result = _failed_batch_result(batch_key, batch_questions, e)
                 
                 # LOGIC UPDATE: We now accumulate metadata in Python, 
                 # instead of expecting the LLM to pass back the full list.
-                batch_metadata = result.pop('_metadata', {})
-                if batch_metadata:
-                    # Initialize if empty
-                    if not accumulated_metadata:
-                        accumulated_metadata = batch_metadata.copy()
-                    else:
-                        # Append new values to existing strings
-                        for key, new_val in batch_metadata.items():
-                            if key in accumulated_metadata:
-                                # Append with comma
-                                current_val = accumulated_metadata[key]
-                                if new_val.strip():
-                                    accumulated_metadata[key] = f"{current_val}, {new_val}"
-                            else:
-                                # New key, just add it
-                                accumulated_metadata[key] = new_val
-                    logger.info(f"[Core Skill] Updated cumulative metadata after {batch_key}")
+                if _merge_metadata(accumulated_metadata, result.pop('_metadata', {})):
+                    logger.info("[Core Skill] Updated cumulative metadata after %s", batch_key)
                 
-                # Add batch results to pipeline results
-                pipeline_results.update(result)
+                type_results.update(result)
+            
+            return type_results
+        
+        # Start every type's sequence immediately as a named task
+        type_tasks = [
+            asyncio.create_task(run_type_sequential(k, v), name=f"core-skill-{k}")
+            for k, v in grouped_questions.items()
+        ]
+        per_type_results = await asyncio.gather(*type_tasks, return_exceptions=True)
+        
+        # Add batch results to pipeline results (in type order)
+        for type_result in per_type_results:
+            if isinstance(type_result, BaseException):
+                logger.error("Core Skill type sequence failed: %s", type_result)
+            else:
+                pipeline_results.update(type_result)
     else:
-        # PARALLEL PROCESSING: Original behavior
-        all_batch_tasks = []
+        # PARALLEL PROCESSING: Producer/consumer work queue
+        # Every batch of every type is queued up front; a fixed pool of workers drains it,
+        # so batches of the same type run concurrently within the global concurrency limit.
+        work_queue: asyncio.Queue = asyncio.Queue()
         
         for base_type_key, all_type_questions in grouped_questions.items():
-            BATCH_SIZE = DEFAULT_BATCH_SIZE
-            batches = [all_type_questions[i:i + BATCH_SIZE] for i in range(0, len(all_type_questions), BATCH_SIZE)]
-            
-            for i, batch_questions in enumerate(batches):
-                batch_key = f"{base_type_key} - Batch {i + 1}"
-                
-                # Create a task for this batch
-                task = process_single_batch_flow(
-                    batch_key=batch_key,
-                    questions=batch_questions,
-                    general_config=general_config,
-                    type_config=None,
-                    validation_prompt_template=validation_prompt_template,
-                    validation_config=validation_config,
-                    progress_callback=progress_callback,
-                    previous_batch_metadata=None
-                )
-                all_batch_tasks.append(task)
-                
-        logger.info(f"🚀 Launching {len(all_batch_tasks)} batch flows in PARALLEL")
+            for i, batch_questions in enumerate(_chunks(all_type_questions, batch_size)):
+                batch_key = batch_key_of(base_type_key, i + 1)
+                # Reserve the key now so results keep type/batch order whatever order they finish in
+                pipeline_results[batch_key] = None
+                work_queue.put_nowait((batch_key, batch_questions))
         
-        # Run everything
-        all_results_list = await asyncio.gather(*all_batch_tasks, return_exceptions=True)
+        total_batches = work_queue.qsize()
+        completed_batches = 0
         
-        # Aggregate results
-        for res in all_results_list:
-            if isinstance(res, dict):
-                # Remove internal _metadata key before adding to results
+        async def batch_worker():
+            nonlocal completed_batches
+            while True:
+                try:
+                    batch_key, batch_questions = work_queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                try:
+                    res = await process_single_batch_flow(
+                        batch_key=batch_key,
+                        questions=batch_questions,
+                        general_config=general_config,
+                        type_config=None,
+                        validation_prompt_template=validation_prompt_template,
+                        validation_config=validation_config,
+                        progress_callback=progress_callback,
+                        previous_batch_metadata=None,
+                        semaphore=semaphore
+                    )
+                except Exception as e:
+                    res = _failed_batch_result(batch_key, batch_questions, e)
+                finally:
+                    work_queue.task_done()
+                
+                # Merge as soon as the batch lands (internal _metadata key is not part of the results)
                 res.pop('_metadata', None)
                 pipeline_results.update(res)
-            elif isinstance(res, Exception):
-                logger.error(f"Batch flow failed: {res}")
+                
+                # Report each batch as soon as it lands rather than after the slowest one
+                # (progress_callback itself already fired inside the flow)
+                completed_batches += 1
+                logger.info("✅ %s finished (%d/%d batches complete)", batch_key, completed_batches, total_batches)
+        
+        # Batch flows in flight (each holds its prompt/response payloads); defaults to the LLM call cap
+        max_parallel_batches = max(1, int(general_config.get('max_parallel_batches') or max_concurrency))
+        num_workers = min(max_parallel_batches, total_batches)
+        logger.info("🚀 Launching %d batch flows in PARALLEL (%d workers)", total_batches, num_workers)
+        
+        crashed = False
+        if num_workers == 1:
+            # A single worker (e.g. regenerating one batch) is awaited directly, without task/gather bookkeeping
+            try:
+                await batch_worker()
+            except Exception as e:
+                crashed = True
+                logger.error("Batch worker failed: %s", e)
+        else:
+            # Run everything; workers start draining the queue as soon as each task is created.
+            # A crashed worker must not cancel its siblings.
+            worker_tasks = [asyncio.create_task(batch_worker(), name=f"batch-worker-{n}") for n in range(num_workers)]
+            worker_results = await asyncio.gather(*worker_tasks, return_exceptions=True)
+            for res in worker_results:
+                if isinstance(res, BaseException):
+                    crashed = True
+                    logger.error("Batch worker failed: %s", res)
+        
+        if crashed:
+            # Drop reserved keys whose batch never produced a result
+            pipeline_results = {k: v for k, v in pipeline_results.items() if v is not None}
+    
+    # Write out any metadata records buffered during this run (off the event loop)
+    await asyncio.to_thread(_METADATA_LOG.flush)
             
     logger.info("Pipeline processing completed.")
     return pipeline_results
@@ -787,79 +940,78 @@ async def regenerate_specific_questions_pipeline(
     original_config: List[Dict[str, Any]],
     regeneration_map: Dict[str, List[int]],
     general_config: Dict[str, Any],
-    progress_callback=None
+    progress_callback=None,
+    *,
+    batch_size: int = DEFAULT_BATCH_SIZE
 ) -> Dict[str, Dict[str, Any]]:
     """
     Regenerate SPECIFIC questions based on their original configuration.
     Wraps the standard batched pipeline for a subset of questions.
+    batch_size must match the one used for the original generation.
     """
-    logger.info(f"Regenerating specific questions: {regeneration_map}")
+    logger.info("Regenerating specific questions: %s", regeneration_map)
+    
+    if not regeneration_map:
+        return {'error': "No questions were selected for regeneration."}
     
     # 1. Sync indices using Priority Packing
     # This must match the original generation logic exactly
-    grouped_batch_map = group_questions_by_type_and_topic(original_config)
+    grouped_batch_map = group_questions_by_type_and_topic(original_config, batch_size)
     
     selected_configs_only = []
+    existing_content_map = general_config.get('existing_content_map', {})
+    regeneration_reasons_map = general_config.get('regeneration_reasons_map', {})
     
     # 2. Extract selected questions by batch_key and relative index
     for batch_key, indices in regeneration_map.items():
         # Handle new Batch Key format (e.g., "MCQ - Batch 1")
-        base_type = batch_key.split(' - Batch ')[0]
-        
-        # Parse batch number from key if present
-        import re
-        batch_match = re.search(r'Batch (\d+)', batch_key)
-        batch_num = int(batch_match.group(1)) if batch_match else 1
+        # (batch number defaults to 1 if the key has no batch suffix)
+        base_type, batch_num = split_batch_key(batch_key)
         
         if base_type not in grouped_batch_map:
-            logger.warning(f"Type {base_type} not found in grouped map during regeneration")
+            logger.warning("Type %s not found in grouped map during regeneration", base_type)
             continue
             
         all_grouped_of_type = grouped_batch_map[base_type]
         
         # Calculate offset based on batch number
-        # Default batch size is 4 
-        BATCH_SIZE = DEFAULT_BATCH_SIZE
-        offset = (batch_num - 1) * BATCH_SIZE
+        offset = (batch_num - 1) * batch_size
+        
+        # Previously generated questions of this batch (for original text lookup)
+        content_for_batch = existing_content_map.get(batch_key, {})
         
         for idx in indices:
             # idx is 1-based index WITHIN the batch (1..4)
             target_grouped_idx = offset + (idx - 1)
             
             if 0 <= target_grouped_idx < len(all_grouped_of_type):
-                q_config = all_grouped_of_type[target_grouped_idx].copy()
-                
-                # Attach Context
-                q_config['_is_being_regenerated'] = True
+                # Fresh per-question config (the grouped source config is never mutated).
+                # Override type to the specific batch key to preserve alignment in process_batches_pipeline:
+                # this ensures the parallel pipeline treats "MCQ - Batch 2" as a distinct task
+                q_config = {
+                    **all_grouped_of_type[target_grouped_idx],
+                    '_is_being_regenerated': True,
+                    'type': batch_key
+                }
                 
                 # Original Text
-                existing_content_map = general_config.get('existing_content_map', {})
-                if batch_key in existing_content_map:
-                    q_key = f"question{idx}"
-                    original_text = existing_content_map[batch_key].get(q_key, "")
-                    if original_text:
-                        q_config['original_text'] = original_text
+                original_text = content_for_batch.get(f"question{idx}", "")
+                if original_text:
+                    q_config['original_text'] = original_text
                 
-                # Regeneration Reason
-                regeneration_reasons_map = general_config.get('regeneration_reasons_map', {})
-                # Look up by "batch_key:idx"
-                reason_id = f"{batch_key}:{idx}"
-                reason = regeneration_reasons_map.get(reason_id, "")
+                # Regeneration Reason (looked up by "batch_key:idx")
+                reason = regeneration_reasons_map.get(f"{batch_key}:{idx}", "")
                 if reason:
                     q_config['regeneration_reason'] = reason
                 
-                # Override type to the specific batch key to preserve alignment in process_batches_pipeline
-                # This ensures the parallel pipeline treats "MCQ - Batch 2" as a distinct task
-                q_config['type'] = batch_key
-                
                 selected_configs_only.append(q_config)
             else:
-                logger.warning(f"Index {idx} out of bounds for {batch_key} (Global mapping failed)")
+                logger.warning("Index %s out of bounds for %s (Global mapping failed)", idx, batch_key)
 
     if not selected_configs_only:
         return {'error': "No valid questions were identified for regeneration. Check index mapping."}
 
-    logger.info(f"Executing standard pipeline for {len(selected_configs_only)} selected questions...")
+    logger.info("Executing standard pipeline for %d selected questions...", len(selected_configs_only))
     
     # 3. Enable prompt saving for regeneration regardless of general config
     regeneration_config = general_config.copy()
@@ -869,17 +1021,15 @@ async def regenerate_specific_questions_pipeline(
     # 4. Execute Standard Pipeline
     # Since we modified the 'type' to includes the batch number, the pipeline will 
     # process them in parallel batches corresponding to their original UI groups.
-    results = await process_batches_pipeline(selected_configs_only, regeneration_config, progress_callback)
+    results = await process_batches_pipeline(selected_configs_only, regeneration_config, progress_callback, batch_size=batch_size)
     
     # 5. Cleanup Keys
     # process_batches_pipeline adds " - Batch 1" because it thinks it's a new generation.
-    # We strip the LAST " - Batch 1" to return keys exactly matching st.session_state.generated_output.
-    fixed_results = {}
-    for k, v in results.items():
-        if ' - Batch 1' in k:
-            original_key = k.rsplit(' - Batch 1', 1)[0]
-            fixed_results[original_key] = v
-        else:
-            fixed_results[k] = v
+    # We strip that trailing suffix (only when a second batch suffix precedes it) to return
+    # keys exactly matching st.session_state.generated_output.
+    fixed_results = {
+        (k.removesuffix(f"{BATCH_KEY_SEP}1") if k.count(BATCH_KEY_SEP) >= 2 else k): v
+        for k, v in results.items()
+    }
             
     return fixed_results
@@ -10,23 +10,14 @@ def extract_json_objects(text: str) -> List[Dict[str, Any]]:
     objects = []
     decoder = json.JSONDecoder()
     pos = 0
-    length = len(text)
     
-    while pos < length:
-        # Find the next opening brace
+    while True:
+        # Jump straight to the next opening brace (C-level scan, no per-character loop)
+        pos = text.find('{', pos)
+        if pos == -1:
+            break
+        
         try:
-            # Skip whitespace
-            while pos < length and text[pos].isspace():
-                pos += 1
-            if pos >= length:
-                break
-                
-            if text[pos] != '{':
-                # Skip until next brace
-                pos = text.find('{', pos)
-                if pos == -1:
-                    break
-            
             # Attempt to decode from this position
             obj, end_pos = decoder.raw_decode(text, idx=pos)
             if isinstance(obj, dict):
@@ -35,7 +26,6 @@ def extract_json_objects(text: str) -> List[Dict[str, Any]]:
             
         except json.JSONDecodeError:
             # If decoding failed, advance past the current '{' and try again
-            # efficiently advance to next '{'
             pos += 1
             
     return objects
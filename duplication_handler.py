@@ -1,40 +1,105 @@
 import asyncio
-import yaml
+import contextlib
 import re
 import json
 import logging
-from pathlib import Path
 from typing import List, Dict, Any, Optional
-from llm_engine import run_gemini_async
+import orjson
+from llm_engine import DEFAULT_MAX_CONCURRENCY, run_gemini_async
+from parse_utils import strip_code_fences
+from prompt_builder import PROMPTS
 
 logger = logging.getLogger(__name__)
 
+# Start of a JSON array or object in the model's reply
+_JSON_START_RE = re.compile(r"[\[{]")
+
+# Shared lenient decoder (strict=False tolerates control characters / backslash sequences in markdown)
+_JSON_DECODER = json.JSONDecoder(strict=False)
+
+# Replies at least this long are parsed via asyncio.to_thread (shorter ones parse faster than the thread hop)
+_OFFLOAD_PARSE_CHARS = 64 * 1024
+
+# Placeholders in the duplicate_question template, filled in a single pass
+_PLACEHOLDER_RE = re.compile(r"\{\{(ORIGINAL_QUESTION|CUSTOM_NOTES|FILE_CONTEXT|VARIATION_COUNT)\}\}")
+
+def _as_duplicates(obj: Any) -> List[Any]:
+    """
+    Normalize a decoded reply (array or object) to the list of variations.
+    """
+    if isinstance(obj, list):
+        return obj
+    # Could be {"duplicates": [...]} or {"variation1": "...", ...}
+    if "duplicates" in obj and isinstance(obj["duplicates"], list):
+        return obj["duplicates"]
+    # Wrap dict as single-item list
+    return [obj]
+
+def _parse_duplicates(text: str) -> Optional[List[Any]]:
+    """
+    Extract the list of variations from the model's reply (first JSON array or object found).
+    Returns None if no JSON could be decoded.
+    """
+    # Strip markdown code fences if present
+    clean = text.strip()
+    if clean.startswith("```"):
+        clean = strip_code_fences(clean).strip()
+    
+    first = _JSON_START_RE.search(clean)
+    if first is None:
+        return None
+    
+    # Fast path: everything from the first '[' / '{' to the last ']' / '}' is one JSON
+    # array/object (single C-level parse), which also covers prose before or after it.
+    # orjson is strict, so replies with raw control characters take the lenient scan below.
+    end = max(clean.rfind(']'), clean.rfind('}')) + 1
+    if end > first.start():
+        try:
+            obj = orjson.loads(clean[first.start():end])
+        except orjson.JSONDecodeError:
+            pass
+        else:
+            return _as_duplicates(obj)
+    
+    # Scan for first JSON array or object, jumping straight to each '[' / '{' candidate
+    for match in _JSON_START_RE.finditer(clean, first.start()):
+        try:
+            obj, _ = _JSON_DECODER.raw_decode(clean, match.start())
+        except json.JSONDecodeError:
+            continue
+        return _as_duplicates(obj)
+    
+    return None
+
 async def duplicate_single_question_async(
     original_markdown: str,
     variation_count: int,
     custom_notes: str,
     context_file: Optional[Any],
-    api_key: str
+    api_key: str,
+    semaphore: Optional[asyncio.Semaphore] = None,
+    save_prompt: bool = False
 ) -> Dict[str, Any]:
     """
     Duplicate a single question using Gemini.
+    If a semaphore is given, the Gemini call holds it while in flight.
+    save_prompt writes the final prompt to prompt_logs (off by default).
     """
-    # Load template
-    prompts_path = Path(__file__).parent / "prompts.yaml"
-    with open(prompts_path, 'r', encoding='utf-8') as f:
-        prompts = yaml.safe_load(f)
-    
-    template = prompts.get('duplicate_question', '')
+    # Template comes from prompts.yaml, parsed once at import by prompt_builder
+    template = PROMPTS.get('duplicate_question', '')
     if not template:
         return {"error": "Template duplicate_question not found in prompts.yaml"}
     
-    # Simple string replacement
+    # Simple placeholder substitution (one scan of the template)
     file_context_str = "[File attached for context]" if context_file else "[No file provided]"
     
-    prompt = template.replace("{{ORIGINAL_QUESTION}}", original_markdown)
-    prompt = prompt.replace("{{CUSTOM_NOTES}}", custom_notes or "None")
-    prompt = prompt.replace("{{FILE_CONTEXT}}", file_context_str)
-    prompt = prompt.replace("{{VARIATION_COUNT}}", str(variation_count))
+    placeholder_values = {
+        "ORIGINAL_QUESTION": original_markdown,
+        "CUSTOM_NOTES": custom_notes or "None",
+        "FILE_CONTEXT": file_context_str,
+        "VARIATION_COUNT": str(variation_count)
+    }
+    prompt = _PLACEHOLDER_RE.sub(lambda m: placeholder_values[m.group(1)], template)
     
     # Call Gemini
     # Metadata for logging
@@ -43,15 +108,16 @@ async def duplicate_single_question_async(
         "filenames": [getattr(context_file, 'name', 'uploaded_file')] if context_file else []
     }
     
-    result = await run_gemini_async(
-        prompt=prompt,
-        api_key=api_key,
-        files=[context_file] if context_file else None,
-        thinking_level="medium",
-        file_metadata=file_metadata,
-        log_name="Duplication",
-        save_prompt=False
-    )
+    async with semaphore or contextlib.nullcontext():
+        result = await run_gemini_async(
+            prompt=prompt,
+            api_key=api_key,
+            files=[context_file] if context_file else None,
+            thinking_level="medium",
+            file_metadata=file_metadata,
+            log_name="Duplication",
+            save_prompt=save_prompt
+        )
     
     if result.get('error'):
         return {"error": result['error']}
@@ -59,43 +125,11 @@ async def duplicate_single_question_async(
     # Parse JSON response — use strict=False to tolerate backslash sequences in markdown
     text = result.get('text', '')
     
-    # Strip markdown code fences if present
-    clean = text.strip()
-    if clean.startswith("```"):
-        clean = re.sub(r"^```(?:json)?\s*\n?", "", clean, flags=re.IGNORECASE)
-        clean = re.sub(r"\n?\s*```$", "", clean)
-        clean = clean.strip()
-    
-    decoder = json.JSONDecoder(strict=False)
-    duplicates = None
-    pos = 0
-    
-    # Scan for first JSON array or object
-    while pos < len(clean):
-        # Skip whitespace
-        while pos < len(clean) and clean[pos].isspace():
-            pos += 1
-        if pos >= len(clean):
-            break
-        if clean[pos] in ('[', '{'):
-            try:
-                obj, _ = decoder.raw_decode(clean, pos)
-                if isinstance(obj, list):
-                    duplicates = obj
-                    break
-                elif isinstance(obj, dict):
-                    # Could be {"duplicates": [...]} or {"variation1": "...", ...}
-                    if "duplicates" in obj and isinstance(obj["duplicates"], list):
-                        duplicates = obj["duplicates"]
-                    else:
-                        # Wrap dict as single-item list
-                        duplicates = [obj]
-                    break
-            except json.JSONDecodeError:
-                pos += 1
-                continue
-        else:
-            pos += 1
+    # Large replies are parsed on a worker thread so sibling duplications' I/O isn't stalled
+    if len(text) >= _OFFLOAD_PARSE_CHARS:
+        duplicates = await asyncio.to_thread(_parse_duplicates, text)
+    else:
+        duplicates = _parse_duplicates(text)
     
     if duplicates is not None:
         return {"duplicates": duplicates, "elapsed": result.get('elapsed', 0)}
@@ -104,12 +138,18 @@ async def duplicate_single_question_async(
 
 async def process_parallel_duplication(
     requests: List[Dict[str, Any]],
-    api_key: str
+    api_key: str,
+    max_concurrency: int = DEFAULT_MAX_CONCURRENCY,
+    save_prompt: bool = False
 ) -> List[Dict[str, Any]]:
     """
-    Process multiple duplication requests in parallel.
+    Process multiple duplication requests in parallel (at most max_concurrency Gemini calls at once).
     requests: list of { original_markdown, variation_count, custom_notes, context_file }
+    Every request gets its own Gemini call (fresh variations); results are returned in request order.
+    save_prompt writes each final prompt to prompt_logs (off by default).
     """
+    # Created per run: the limit is a per-call argument, not shared across sessions
+    semaphore = asyncio.Semaphore(max(1, max_concurrency))
     tasks = []
     for req in requests:
         tasks.append(duplicate_single_question_async(
@@ -117,7 +157,9 @@ async def process_parallel_duplication(
             variation_count=req['variation_count'],
             custom_notes=req.get('custom_notes', ''),
             context_file=req.get('context_file'),
-            api_key=api_key
+            api_key=api_key,
+            semaphore=semaphore,
+            save_prompt=save_prompt
         ))
     
     return await asyncio.gather(*tasks)
@@ -1,10 +1,22 @@
 from pathlib import Path
 
 filename = Path(__file__).parent / "prompts.yaml"
+key = b"mcq_questions"
 try:
-    with open(filename, "r", encoding="utf-8") as f:
-        for i, line in enumerate(f, 1):
-            if "mcq_questions" in line:
-                print(f"Line {i}: {line.strip()}")
+    # Search the raw bytes (C-level scan); only matching lines are decoded
+    data = filename.read_bytes()
+    line_no = 1
+    counted_to = 0
+    hit = data.find(key)
+    while hit != -1:
+        line_start = data.rfind(b"\n", 0, hit) + 1
+        line_end = data.find(b"\n", hit)
+        if line_end == -1:
+            line_end = len(data)
+        line_no += data.count(b"\n", counted_to, line_start)
+        counted_to = line_start
+        print(f"Line {line_no}: {data[line_start:line_end].decode('utf-8').strip()}")
+        # Each matching line is reported once, like the line-by-line scan
+        hit = data.find(key, line_end)
 except Exception as e:
     print(f"Error: {e}")
@@ -1,13 +1,18 @@
-import yaml
+import re
 import os
 
+from parse_utils import load_yaml
+
+# Any {{Placeholder}} in a template; unknown ones are left as-is when substituting
+_PLACEHOLDER_RE = re.compile(r"\{\{(\w+)\}\}")
+
 # Helper to load prompts
 def load_prompts(file_path='prompts.yaml'):
     if not os.path.exists(file_path):
         print(f"Error: {file_path} not found.")
         return {}
     with open(file_path, 'r', encoding='utf-8') as f:
-        return yaml.safe_load(f)
+        return load_yaml(f)
 
 # Helper to generate TOPICS_SECTION string
 def generate_topics_section(topics_config):
@@ -24,25 +29,25 @@ def generate_topics_section(topics_config):
       ...
     ]
     """
-    section = "## TOPICS AND CONFIGURATION:\n"
+    parts = ["## TOPICS AND CONFIGURATION:\n"]
     total_questions = 0
     for idx, t in enumerate(topics_config, 1):
-        section += f"  Topic {idx}: {t['topic']}\n"
-        section += f"    - Quantity: {t['number_of_questions']}\n"
-        if 'dok' in t:
-             section += f"    - DOK Level: {t['dok']}\n"
-        if 'marks' in t:
-             section += f"    - Marks: {t['marks']}\n"
-        if 'taxonomy' in t:
-             section += f"    - Taxonomy: {t['taxonomy']}\n"
-        section += "\n"
+        # Optional fields are only listed when present in the topic config
+        optional_lines = "".join(
+            f"    - {label}: {t[k]}\n"
+            for k, label in (('dok', 'DOK Level'), ('marks', 'Marks'), ('taxonomy', 'Taxonomy'))
+            if k in t
+        )
+        parts.append(f"  Topic {idx}: {t['topic']}\n    - Quantity: {t['number_of_questions']}\n{optional_lines}\n")
         total_questions += t['number_of_questions']
     
-    return section, total_questions
+    return "".join(parts), total_questions
 
 # Runner
-def run_prompt_test(prompt_key, topics_config, output_file=None):
-    prompts = load_prompts()
+def run_prompt_test(prompt_key, topics_config, output_file=None, prompts=None):
+    # Callers testing several keys pass the already-loaded prompts to avoid re-parsing the YAML
+    if prompts is None:
+        prompts = load_prompts()
     if prompt_key not in prompts:
         print(f"Error: Key {prompt_key} not found in prompts.yaml")
         return
@@ -72,11 +77,11 @@ def run_prompt_test(prompt_key, topics_config, output_file=None):
         "Taxonomy": "See Topic Config"
     }
 
-    # Replace placeholders
-    prompt = template
-    for k, v in input_data.items():
-        placeholder = "{{" + k + "}}"
-        prompt = prompt.replace(placeholder, str(v))
+    # Replace placeholders (single pass over the template)
+    prompt = _PLACEHOLDER_RE.sub(
+        lambda m: str(input_data[m.group(1)]) if m.group(1) in input_data else m.group(0),
+        template
+    )
     
     print(f"Successfully generated prompt for key: {prompt_key}")
     
@@ -118,5 +123,6 @@ if __name__ == "__main__":
         "case_study_maths_pdf"
     ]
     
+    prompts = load_prompts()
     for key in keys_to_test:
-        run_prompt_test(key, test_topics, f"test_output_{key}.txt")
+        run_prompt_test(key, test_topics, f"test_output_{key}.txt", prompts)
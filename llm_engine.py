@@ -5,13 +5,16 @@ Handles synchronous and asynchronous calls to Gemini API with File API support.
 
 import time
 import asyncio
+import functools
+import hashlib
+import io
 import logging
-import tempfile
-import os
+import mimetypes
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
 from typing import Dict, Any, Optional, List
 from google import genai
-from google.genai import types
+from google.genai import errors, types
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -22,6 +25,45 @@ import threading
 # Global lock for file reading to prevent race conditions during parallel batches
 file_read_lock = threading.Lock()
 
+# Default cap on in-flight Gemini calls for one pipeline or duplication run
+# (batch runs can override it with general_config['max_concurrency'])
+DEFAULT_MAX_CONCURRENCY = 8
+
+# Upper bound on concurrent File API uploads per call
+MAX_UPLOAD_WORKERS = 8
+
+# Uploaded files, keyed by (api_key, content hash) -> (Future of the uploaded file, expiry time).
+# Parallel batches attach the same PDF, so it is uploaded once and the handle shared.
+# The File API deletes files after 48 hours; entries expire well before that and are pruned
+# on the next upload. A failed Gemini call drops the entries of the files it used.
+UPLOAD_CACHE_TTL = 40 * 3600
+_upload_cache: Dict[tuple, tuple] = {}
+_upload_cache_lock = threading.Lock()
+
+# Upper bound on Gemini calls streaming at once. They get their own pool so they neither
+# wait behind nor starve the default executor (min(32, cpu + 4) threads, shared by to_thread)
+MAX_GEMINI_WORKERS = 32
+_gemini_executor = ThreadPoolExecutor(max_workers=MAX_GEMINI_WORKERS, thread_name_prefix="gemini")
+
+# Single background writer for prompt logs (errors are logged by _save_prompt_to_file)
+_prompt_log_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="prompt-log")
+
+# Maps every ASCII character except letters, digits and "._-" to "_" (one C-level pass per name)
+_FILENAME_SAFE_TABLE = str.maketrans({
+    c: "_" for c in map(chr, range(128)) if not (c.isalnum() or c in "._-")
+})
+
+@functools.lru_cache(maxsize=8)
+def _get_client(api_key: str) -> genai.Client:
+    """
+    Return a shared Gemini client for the API key, so its HTTP connection pool
+    is reused across calls instead of being rebuilt for every request.
+    """
+    # Initialize client with extended timeout (10 minutes) to accommodate thinking models
+    # Initialize client with extended timeout (10 minutes = 600,000ms if units are ms, or long duration if seconds)
+    # The API requires a deadline >= 10s for thinking models.
+    return genai.Client(api_key=api_key, http_options={'timeout': 600000})
+
 def _save_prompt_to_file(prompt: str, log_name: str = "prompt") -> Optional[str]:
     """
     Save the final prompt to a file in prompt_logs directory.
@@ -31,7 +73,8 @@ def _save_prompt_to_file(prompt: str, log_name: str = "prompt") -> Optional[str]
         log_dir.mkdir(exist_ok=True)
         
         timestamp = time.strftime("%Y%m%d_%H%M%S")
-        filename = f"{log_name}_{timestamp}.txt"
+        # Batch keys contain spaces and e.g. "w/", which must not end up in the path
+        filename = f"{log_name.translate(_FILENAME_SAFE_TABLE)}_{timestamp}.txt"
         filepath = log_dir / filename
         
         with open(filepath, "w", encoding="utf-8") as f:
@@ -43,6 +86,58 @@ def _save_prompt_to_file(prompt: str, log_name: str = "prompt") -> Optional[str]
         logger.error(f"Failed to save prompt: {e}")
         return None
 
+def _upload_bytes(client: genai.Client, data: bytes, filename: str, file_ext: str) -> Any:
+    """
+    Upload file contents to the File API straight from memory (no temp file round trip).
+    """
+    mime_type = mimetypes.guess_type(f"upload{file_ext}")[0] or "application/pdf"
+    return client.files.upload(
+        file=io.BytesIO(data),
+        config={'mime_type': mime_type, 'display_name': filename}
+    )
+
+def _prune_upload_cache(now: float) -> None:
+    """
+    Drop expired upload cache entries. Caller must hold _upload_cache_lock.
+    """
+    expired = [key for key, (_, expiry) in _upload_cache.items() if expiry <= now]
+    for key in expired:
+        del _upload_cache[key]
+
+def _is_uploaded_file_error(error: Exception, uploaded_files: List) -> bool:
+    """
+    True if a failed request was rejected because of its uploaded files (gone, not ours, or
+    named as invalid), as opposed to rate limits, server errors or timeouts.
+    """
+    if not uploaded_files or not isinstance(error, errors.APIError):
+        return False
+    if error.code == 404 or error.status == 'PERMISSION_DENIED':
+        return True
+    if error.status == 'INVALID_ARGUMENT':
+        message = str(error)
+        return any(
+            ref and ref in message
+            for uploaded in uploaded_files
+            for ref in (getattr(uploaded, 'uri', None), getattr(uploaded, 'name', None))
+        )
+    return False
+
+def _forget_uploaded_files(uploaded_files: List) -> None:
+    """
+    Drop the upload cache entries holding these file handles, so the next call uploads afresh
+    (after a request was rejected because the server-side files are gone or unusable).
+    """
+    if not uploaded_files:
+        return
+    with _upload_cache_lock:
+        stale = [
+            key for key, (future, _) in _upload_cache.items()
+            if future.done() and future.exception() is None
+            and any(future.result() is uploaded for uploaded in uploaded_files)
+        ]
+        for key in stale:
+            del _upload_cache[key]
+
 def upload_files_to_gemini(files: List, api_key: str) -> List:
     """
     Upload multiple PDF and image files to Gemini File API and return file objects.
@@ -57,11 +152,10 @@ def upload_files_to_gemini(files: List, api_key: str) -> List:
     if not files:
         return []
     
-    client = genai.Client(api_key=api_key, http_options={'timeout': 600000})
-    uploaded_files = []
+    client = _get_client(api_key)
+    staged = []  # (filename, file_ext, data) in input order
     
     for file in files:
-        tmp_path = None
         try:
             # Thread-safe file reading
             # We must lock because multiple parallel batches might try to seek/read 
@@ -73,32 +167,65 @@ def upload_files_to_gemini(files: List, api_key: str) -> List:
                 # Get file extension from filename
                 filename = getattr(file, 'name', 'uploaded_file')
                 file_ext = Path(filename).suffix if '.' in filename else '.pdf'
-                
-                # Create a temporary file (File API needs file path)
-                with tempfile.NamedTemporaryFile(delete=False, suffix=file_ext) as tmp_file:
-                    tmp_file.write(file.read())
-                    tmp_path = tmp_file.name
+                data = file.read()
             
-            # Upload to Gemini File API (OUTSIDE the lock for parallelism)
-            logger.info(f"Uploading file to Gemini File API: {filename}")
-            
-            uploaded = client.files.upload(file=tmp_path)
-            uploaded_files.append(uploaded)
-            
-            logger.info(f"Successfully uploaded: {filename} (URI: {uploaded.name})")
+            staged.append((filename, file_ext, data))
             
         except Exception as e:
-            logger.error(f"Failed to upload file {getattr(file, 'name', 'unknown')}: {e}")
+            logger.error(f"Failed to read file {getattr(file, 'name', 'unknown')}: {e}")
             # Continue with other files even if one fails
+    
+    def _upload(item):
+        filename, file_ext, data = item
+        # Uploaded files belong to the key's project, so the key is part of the cache key
+        cache_key = (api_key, hashlib.blake2b(data, digest_size=16).hexdigest())
+        
+        now = time.time()
+        with _upload_cache_lock:
+            cached = _upload_cache.get(cache_key)
+            owner = cached is None or cached[1] <= now
+            if owner:
+                _prune_upload_cache(now)
+                future = Future()
+                _upload_cache[cache_key] = (future, now + UPLOAD_CACHE_TTL)
+            else:
+                future = cached[0]
+        
+        if not owner:
+            # Same bytes already uploaded (or uploading) for this key: reuse that handle
+            try:
+                uploaded = future.result()
+                logger.info(f"Reusing uploaded file: {filename} (URI: {uploaded.name})")
+                return uploaded
+            except Exception as e:
+                logger.error(f"Failed to upload file {filename}: {e}")
+                return None
+        
+        try:
+            logger.info(f"Uploading file to Gemini File API: {filename}")
+            uploaded = _upload_bytes(client, data, filename, file_ext)
+            future.set_result(uploaded)
+            logger.info(f"Successfully uploaded: {filename} (URI: {uploaded.name})")
+            return uploaded
             
-        finally:
-            # Clean up temp file
-            if tmp_path and os.path.exists(tmp_path):
-                try:
-                    os.remove(tmp_path)
-                except Exception as cleanup_error:
-                   logger.warning(f"Failed to cleanup temp file {tmp_path}: {cleanup_error}")
+        except Exception as e:
+            # Drop the failed entry so the next request retries the upload
+            with _upload_cache_lock:
+                if _upload_cache.get(cache_key, (None,))[0] is future:
+                    del _upload_cache[cache_key]
+            future.set_exception(e)
+            logger.error(f"Failed to upload file {filename}: {e}")
+            return None
     
+    # Uploads are network-bound, so run them concurrently (OUTSIDE the lock);
+    # map() keeps the results in input order
+    if len(staged) > 1:
+        with ThreadPoolExecutor(max_workers=min(MAX_UPLOAD_WORKERS, len(staged))) as executor:
+            results = list(executor.map(_upload, staged))
+    else:
+        results = [_upload(item) for item in staged]
+    
+    uploaded_files = [uploaded for uploaded in results if uploaded is not None]
     return uploaded_files
 
 
@@ -126,17 +253,16 @@ def run_gemini(
     """
     out = {"text": "", "error": None, "elapsed": 0}
     start = time.time()
+    uploaded_files = []
     
     try:
         # Save prompt to file if enabled
         if save_prompt:
+            # Written in the background so the request isn't held up by disk I/O
             logger.info(f"Saving {log_name} prompt to file...")
-            _save_prompt_to_file(prompt, log_name)
+            _prompt_log_executor.submit(_save_prompt_to_file, prompt, log_name)
 
-        # Initialize client with extended timeout (10 minutes) to accommodate thinking models
-        # Initialize client with extended timeout (10 minutes = 600,000ms if units are ms, or long duration if seconds)
-        # The API requires a deadline >= 10s for thinking models.
-        client = genai.Client(api_key=api_key, http_options={'timeout': 600000})
+        client = _get_client(api_key)
         
         # Log execution start with file info
         if file_metadata and files:
@@ -177,20 +303,21 @@ def run_gemini(
             config=config
         )
 
-        agg = ""
-        chunk_count = 0
+        parts = []
         usage_metadata = None
         
         for chunk in stream:
             txt = getattr(chunk, "text", "") or ""
             if txt:
-                agg += txt
-                chunk_count += 1
+                parts.append(txt)
             
             # Capture usage metadata from the last chunk
             if hasattr(chunk, 'usage_metadata'):
                 usage_metadata = chunk.usage_metadata
 
+        # Join once instead of re-copying the growing text on every chunk
+        agg = "".join(parts)
+        chunk_count = len(parts)
         out["text"] = agg
         
         # Extract token usage for cost calculation
@@ -209,6 +336,9 @@ def run_gemini(
         logger.error(f"Gemini execution failed: {e}")
         out["error"] = str(e)
         out["text"] = f"[Gemini Error] {e}"
+        # Don't keep reusing handles the server rejected; keep them for 429/5xx/timeouts
+        if _is_uploaded_file_error(e, uploaded_files):
+            _forget_uploaded_files(uploaded_files)
         
     finally:
         out["elapsed"] = time.time() - start
@@ -226,5 +356,11 @@ async def run_gemini_async(
 ) -> Dict[str, Any]:
     """
     Async wrapper for run_gemini.
+    Runs on a dedicated thread pool, so concurrency is bounded by the callers' semaphores
+    rather than by the size of the default executor.
     """
-    return await asyncio.to_thread(run_gemini, prompt, api_key, files, thinking_level, file_metadata, log_name, save_prompt)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _gemini_executor,
+        functools.partial(run_gemini, prompt, api_key, files, thinking_level, file_metadata, log_name, save_prompt)
+    )
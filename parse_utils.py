@@ -0,0 +1,51 @@
+"""
+Parsing helpers shared by the prompt, batch, duplication and rendering modules.
+YAML loading, markdown fence stripping and the JSON fast path live here once.
+"""
+
+import re
+from typing import Any, Dict, Optional
+
+import orjson
+import yaml
+
+try:
+    from yaml import CSafeLoader as YamlLoader  # libyaml-backed, ~10x faster
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
+
+# Markdown code fences wrapped around LLM JSON output
+FENCE_OPEN_RE = re.compile(r"^```(?:json)?\s*\n?", re.IGNORECASE)
+FENCE_CLOSE_RE = re.compile(r"\n?\s*```$")
+
+
+def load_yaml(stream: Any) -> Any:
+    """
+    Parse a YAML document (string or open file) with the safe loader.
+    """
+    return yaml.load(stream, Loader=YamlLoader)
+
+
+def strip_code_fences(text: str) -> str:
+    """
+    Remove a leading ```/```json fence line and a trailing ``` fence.
+    """
+    text = FENCE_OPEN_RE.sub("", text)
+    return FENCE_CLOSE_RE.sub("", text)
+
+
+def loads_json_object(text: str) -> Optional[Dict[str, Any]]:
+    """
+    Fast path for LLM output that is exactly one JSON object (one C-level parse, no scan).
+    Returns None when it is not; orjson is strict about control characters, so callers
+    fall back to their lenient raw_decode scan for anything rejected here.
+    """
+    stripped = text.strip()
+    if stripped.startswith('{') and stripped.endswith('}'):
+        try:
+            obj = orjson.loads(stripped)
+        except orjson.JSONDecodeError:
+            return None
+        if isinstance(obj, dict):
+            return obj
+    return None
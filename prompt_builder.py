@@ -3,11 +3,13 @@ Prompt Builder for Question Generation
 Constructs prompts from templates with proper placeholder replacement.
 """
 
-import yaml
+import re
 from typing import Dict, List, Any, Optional
 from pathlib import Path
 import logging
 
+from parse_utils import load_yaml
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -15,7 +17,10 @@ logger = logging.getLogger(__name__)
 PROMPTS_FILE = Path(__file__).parent / "prompts.yaml"
 
 with open(PROMPTS_FILE, 'r', encoding='utf-8') as f:
-    PROMPTS = yaml.safe_load(f)
+    PROMPTS = load_yaml(f)
+
+# Any {{Placeholder}} in a template; unknown ones are left as-is when substituting
+_PLACEHOLDER_RE = re.compile(r"\{\{\w+\}\}")
 
 # Mapping from UI question types to prompt template keys
 QUESTION_TYPE_MAPPING = {
@@ -599,8 +604,8 @@ def build_prompt_for_batch(
             if len(lines) > 1:
                 prompt = lines[0] + '\n' + reference_instruction + '\n\n' + lines[1]
     
-    for placeholder, value in replacements.items():
-        prompt = prompt.replace(placeholder, value)
+    # Single pass over the template for all placeholders
+    prompt = _PLACEHOLDER_RE.sub(lambda m: replacements.get(m.group(0), m.group(0)), prompt)
     
     # Core Skill Extraction: Append instructions if enabled
     core_skill_enabled = general_config.get('core_skill_enabled', False)
@@ -4,38 +4,44 @@ Renders questions in the new simplified format: { "question1": "markdown", "ques
 Question type is inferred from batch_key parameter.
 """
 import streamlit as st
+import streamlit.components.v1 as components
 import json
+import logging
 import re
 import html
 from typing import Dict, List, Any, Optional
 
+from parse_utils import loads_json_object, strip_code_fences
+
+# Compiled once; these run for every batch on every Streamlit rerun
+# Use strict=False to allow control characters (newlines) inside strings
+_JSON_DECODER = json.JSONDecoder(strict=False)
+_QUESTION_KEY_RE = re.compile(r'^(question|q)\d+$', re.IGNORECASE)
+_QUESTION_PAIR_RE = re.compile(r'["\'](question\d+)["\']\s*:\s*["\'](.*?)["\']', re.DOTALL | re.IGNORECASE)
+_DIGITS_RE = re.compile(r"\d+")
+
 
 def extract_json_objects(text: str) -> List[Dict[str, Any]]:
     """
     Robustly extract JSON objects from text using json.JSONDecoder.
     This handles braces inside strings correctly, unlike simple stack counting.
     """
+    # Fast path: the whole text is a single JSON object; anything else takes the lenient scan below
+    obj = loads_json_object(text)
+    if obj is not None:
+        return [obj]
+    
     objects = []
-    # Use strict=False to allow control characters (newlines) inside strings
-    decoder = json.JSONDecoder(strict=False)
+    decoder = _JSON_DECODER
     pos = 0
-    length = len(text)
     
-    while pos < length:
-        # Find the next opening brace
+    while True:
+        # Jump straight to the next opening brace (C-level scan, no per-character loop)
+        pos = text.find('{', pos)
+        if pos == -1:
+            break
+        
         try:
-            # Skip whitespace
-            while pos < length and text[pos].isspace():
-                pos += 1
-            if pos >= length:
-                break
-                
-            if text[pos] != '{':
-                # Skip until next brace
-                pos = text.find('{', pos)
-                if pos == -1:
-                    break
-            
             # Attempt to decode from this position
             obj, end_pos = decoder.raw_decode(text, idx=pos)
             if isinstance(obj, dict):
@@ -44,7 +50,6 @@ def extract_json_objects(text: str) -> List[Dict[str, Any]]:
             
         except json.JSONDecodeError:
             # If decoding failed, advance past the current '{' and try again
-            # efficiently advance to next '{'
             pos += 1
             
     return objects
@@ -84,14 +89,14 @@ def extract_question_values_fallback(json_objects: List[Dict[str, Any]]) -> Dict
         # Extract any keys containing "question" (case-insensitive)
         for key, value in flattened.items():
             # Case-insensitive match for "question"
-            if re.search(r'question', key, re.IGNORECASE):
+            if 'question' in key.lower():
                 # Only accept string values for rendering
                 if isinstance(value, str):
                     questions_dict[key] = value
                 elif isinstance(value, dict):
                     # If it's a dict, try to extract a "question" sub-key
                     for sub_key, sub_value in value.items():
-                        if re.search(r'question', sub_key, re.IGNORECASE) and isinstance(sub_value, str):
+                        if 'question' in sub_key.lower() and isinstance(sub_value, str):
                             questions_dict[f"{key}.{sub_key}"] = sub_value
     
     return questions_dict
@@ -147,8 +152,7 @@ def normalize_llm_output_to_questions(text: str) -> Dict[str, str]:
                 pass
                 
         # Strip markdown code fences
-        text = re.sub(r"^```(?:json)?\s*\n?", "", text, flags=re.IGNORECASE)
-        text = re.sub(r"\n?\s*```$", "", text)
+        text = strip_code_fences(text)
         text = text.strip()
     
     questions = {}
@@ -161,10 +165,10 @@ def normalize_llm_output_to_questions(text: str) -> Dict[str, str]:
         if isinstance(text, str) and text.strip():
             # Check if it contains "questionX" pattern even if not valid JSON
             # This handles cases where LLM output is malformed but contains the key
-            match = re.search(r'["\'](question\d+)["\']\s*:\s*["\'](.*?)["\']', text, re.DOTALL | re.IGNORECASE)
+            match = _QUESTION_PAIR_RE.search(text)
             if match:
                 k, v = match.groups()
-                num = re.search(r"\d+", k)
+                num = _DIGITS_RE.search(k)
                 if num:
                     questions[f"question{num.group()}"] = unescape_json_string(v)
             else:
@@ -188,11 +192,11 @@ def normalize_llm_output_to_questions(text: str) -> Dict[str, str]:
             
             for k, v in target.items():
                 # Only process keys matching question pattern
-                if not re.match(r'^(question|q)\d+$', k, re.IGNORECASE):
+                if not _QUESTION_KEY_RE.match(k):
                     continue
                 
                 # Normalize the key to consistent questionX format
-                num = re.search(r"\d+", k)
+                num = _DIGITS_RE.search(k)
                 if not num:
                     continue
                 normalized_key = f"question{num.group()}"
@@ -203,8 +207,7 @@ def normalize_llm_output_to_questions(text: str) -> Dict[str, str]:
                     
                     # Strip fences inside values
                     if s.startswith("```"):
-                        s = re.sub(r"^```(?:json)?\s*\n?", "", s, flags=re.IGNORECASE)
-                        s = re.sub(r"\n?\s*```$", "", s)
+                        s = strip_code_fences(s)
                     
                     # Handle double-encoded JSON
                     if s.startswith("{"):
@@ -283,7 +286,7 @@ def render_markdown_question(question_key: str, markdown_content: str, question_
     }
     
     # Extract base type for emoji lookup
-    base_type = question_type.split(' - Batch ')[0] if question_type else ""
+    base_type = question_type.partition(' - Batch ')[0] if question_type else ""
     emoji = type_emoji_map.get(base_type, "❓")
     
     # Create unique session state keys for this question with context namespace
@@ -374,8 +377,6 @@ def render_markdown_question(question_key: str, markdown_content: str, question_
         
         with col_copy:
             # Add copy-to-clipboard button with markdown stripping
-            import streamlit.components.v1 as components
-            import json
             
             copy_button_key = f"copy_{render_context}_{batch_key}_{question_key}"
             
@@ -484,8 +485,6 @@ def render_markdown_question(question_key: str, markdown_content: str, question_
             
             with dup_col2:
                 # Add copy button for duplicate with markdown stripping
-                import streamlit.components.v1 as components
-                import json
                 
                 dup_copy_key = f"copy_dup_{render_context}_{batch_key}_{question_key}_{i}"
                 
@@ -597,8 +596,11 @@ def render_batch_results(batch_key: str, result_data: Dict[str, Any], render_con
     st.markdown("")  # spacing
     
     # Sort questions by number (question1, question2, question3, etc.)
-    sorted_keys = sorted(questions_dict.keys(), 
-                        key=lambda x: int(re.search(r'\d+', x).group()) if re.search(r'\d+', x) else 0)
+    def _question_number(key: str) -> int:
+        num = _DIGITS_RE.search(key)
+        return int(num.group()) if num else 0
+    
+    sorted_keys = sorted(questions_dict.keys(), key=_question_number)
     
     # =======================================================================
     # RENDER - After normalization, we ONLY have markdown strings
@@ -615,10 +617,8 @@ def render_batch_results(batch_key: str, result_data: Dict[str, Any], render_con
         
         # Safe type check — a hard assert here would crash the loop and hide remaining questions
         if not isinstance(markdown_content, str):
-            import logging as _log
-            _log.getLogger(__name__).warning(f"Normalization produced non-string for {q_key}: {type(markdown_content)}")
-            import json as _j
-            markdown_content = _j.dumps(markdown_content, indent=2, ensure_ascii=False) if isinstance(markdown_content, (dict, list)) else str(markdown_content)
+            logging.getLogger(__name__).warning(f"Normalization produced non-string for {q_key}: {type(markdown_content)}")
+            markdown_content = json.dumps(markdown_content, indent=2, ensure_ascii=False) if isinstance(markdown_content, (dict, list)) else str(markdown_content)
         
         # Render markdown directly - no JSON parsing, no guessing
         render_markdown_question(q_key, markdown_content, batch_key, batch_key, render_context)